@@ -1,70 +1,146 @@
 import os
-from typing import List
+from concurrent.futures import ProcessPoolExecutor
+from typing import Iterator, List
+import numpy as np
 from pypdf import PdfReader
-from sentence_transformers import SentenceTransformer
-import chromadb
-from chromadb.utils import embedding_functions
+
+# Chunking parameters, collection and embedder come from rag_utils (and so from
+# the same RAG_* environment variables), so this script and the server agree on
+# file digests and never mix differently chunked or embedded vectors
+from rag_utils import (
+    CHUNK_SIZE, CHUNK_OVERLAP, DEFAULT_PDF_DIR, EMBED_BATCH_SIZE,
+    dedupe_chunks, file_digest, get_collection, get_embedder, get_stored_digest,
+    update_indexed_pdfs
+)
 
 # Parameters
-PDF_DIR = 'sample_pdfs'
-CHUNK_SIZE = 1500
-CHUNK_OVERLAP = 400
-CHROMA_COLLECTION = 'rag_pdf_collection'
+PDF_DIR = DEFAULT_PDF_DIR
+VERBOSE = __debug__ and bool(os.environ.get("RAG_VERBOSE"))  # dump chunk text
 
-# 1. Extract PDF text
-def read_pdf(file_path: str) -> str:
+# 1. Extract PDF text, one page at a time
+def iter_pdf_pages(file_path: str) -> Iterator[str]:
     reader = PdfReader(file_path)
-    text = ''
     for page in reader.pages:
-        if page.extract_text():
-            text += page.extract_text() + '\n'
-    return text.strip()
+        page_text = page.extract_text()
+        if page_text:
+            yield page_text
 
 # 2. Chunk text
 def chunk_text(text: str, chunk_size: int, overlap: int) -> List[str]:
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
-
-# 3. Load embedding model
-embedder = SentenceTransformer('all-MiniLM-L6-v2')  # Small & fast
-
-# 4. ChromaDB setup
-client = chromadb.PersistentClient(path="chromadb_store")
-if CHROMA_COLLECTION in [c.name for c in client.list_collections()]:
-    collection = client.get_collection(CHROMA_COLLECTION)
-else:
-    collection = client.create_collection(CHROMA_COLLECTION)
-
-# 5. Ingest all PDFs
-for filename in os.listdir(PDF_DIR):
-    if filename.lower().endswith('.pdf'):
-        file_path = os.path.join(PDF_DIR, filename)
-        print(f"Processing {filename}...")
-        text = read_pdf(file_path)
-        print("--------------------------------------------------")
-        print(text)
-        print("--------------------------------------------------")
-        chunks = chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
-
-        print("--------------------------------------------------")
-        print(chunks)
-        print("--------------------------------------------------")
-        embeddings = embedder.encode(chunks)
-        metadatas = [{"source": filename, "chunk_id": i} for i in range(len(chunks))]
-        ids = [f"{filename}_chunk_{i}" for i in range(len(chunks))]
-
-        # Store in ChromaDB
+    step = chunk_size - overlap
+    return [text[start:start + chunk_size] for start in range(0, len(text), step)]
+
+def iter_pdf_chunks(file_path: str, chunk_size: int, overlap: int) -> Iterator[str]:
+    """Yield the same chunks as chunk_text(read whole PDF) without holding the whole text."""
+    step = chunk_size - overlap
+    buf = ''
+    started = False
+    for page_text in iter_pdf_pages(file_path):
+        buf += page_text + '\n'
+        if not started:
+            buf = buf.lstrip()
+        # Only emit chunks that lie entirely before trailing whitespace, which
+        # the whole-document strip() would have dropped
+        content_len = len(buf.rstrip())
+        while content_len >= chunk_size:
+            started = True
+            yield buf[:chunk_size]
+            buf = buf[step:]
+            content_len -= step
+    yield from chunk_text(buf.rstrip(), chunk_size, overlap)
+
+def extract_chunks(file_path: str) -> List[str]:
+    """
+    Worker entry point: read and chunk one PDF (runs in a child process),
+    dropping repeated chunks by the same rule as rag_utils.
+    """
+    return dedupe_chunks(iter_pdf_chunks(file_path, CHUNK_SIZE, CHUNK_OVERLAP))
+
+
+def main():
+    # 3. Load embedding model (GPU + fp16 when available, or RAG_EMBED_ONNX)
+    embedder = get_embedder()
+
+    # 4. ChromaDB setup
+    collection = get_collection()
+
+    # 5. Extract and chunk all PDFs in parallel; pypdf is pure-Python and CPU-bound,
+    # while the embedder stays in this process so the model is loaded only once
+    with os.scandir(PDF_DIR) as it:
+        pdf_entries = [e for e in it if e.name.lower().endswith('.pdf') and e.is_file()]
+
+    # Skip files whose content is unchanged since the last run
+    digests = {}
+    for entry in pdf_entries:
+        digest = file_digest(entry.path)
+        previous = get_stored_digest(entry.name)
+        if previous == digest:
+            print(f"Skipping {entry.name} (unchanged)")
+            continue
+        digests[entry.name] = digest
+    pdf_entries = [e for e in pdf_entries if e.name in digests]
+    filenames = [e.name for e in pdf_entries]
+    file_paths = [e.path for e in pdf_entries]
+    all_chunks = []
+    all_ids = []
+    all_metadatas = []
+    file_spans = []  # (filename, start, end) into the pooled lists
+    with ProcessPoolExecutor() as ex:
+        futures = [ex.submit(extract_chunks, path) for path in file_paths]
+        for filename, future in zip(filenames, futures):
+            # A PDF that fails to parse keeps its previously stored chunks
+            try:
+                chunks = future.result()
+            except Exception as e:
+                print(f"Error processing {filename}: {e}")
+                continue
+            print(f"Processed {filename}: {len(chunks)} chunks")
+            if VERBOSE:
+                print("--------------------------------------------------")
+                print(chunks)
+                print("--------------------------------------------------")
+            start = len(all_chunks)
+            all_chunks.extend(chunks)
+            prefix = f"{filename}_chunk_"
+            file_hash = digests[filename]
+            for i in range(len(chunks)):
+                all_metadatas.append({"source": filename, "chunk_id": i, "file_hash": file_hash})
+                all_ids.append(prefix + str(i))
+            file_spans.append((filename, start, len(all_chunks)))
+
+    # 6. Embed every chunk in one pass so sentence-transformers can length-sort
+    # across the whole corpus (less padding per batch)
+    if all_chunks:
+        embeddings = embedder.encode(
+            all_chunks,
+            batch_size=EMBED_BATCH_SIZE,
+            show_progress_bar=True,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        ).astype(np.float32, copy=False)  # fp16 on CUDA; Chroma wants fp32
+
+    # 7. Store in ChromaDB, one add per file, replacing that file's old chunks
+    for filename, start, end in file_spans:
+        collection.delete(where={"source": filename})
+        if start == end:
+            continue
         collection.add(
-            documents=chunks,
-            embeddings=embeddings.tolist(),
-            metadatas=metadatas,
-            ids=ids
+            documents=all_chunks[start:end],
+            embeddings=embeddings[start:end],  # ndarray view, no per-float PyObjects
+            metadatas=all_metadatas[start:end],
+            ids=all_ids[start:end]
         )
-        print(f"Stored {len(chunks)} chunks from {filename}.")
+        print(f"Stored {end - start} chunks from {filename}.")
+
+    # Keep rag_utils' indexed-filename list in sync; files whose new extraction
+    # is empty had their chunks deleted above, so they leave the list
+    update_indexed_pdfs(
+        added=[filename for filename, start, end in file_spans if end > start],
+        removed=[filename for filename, start, end in file_spans if end == start],
+    )
+
+    print("Ingestion complete! Chunks are now in ChromaDB.")
+
 
-print("Ingestion complete! Chunks are now in ChromaDB.")
+if __name__ == "__main__":
+    main()
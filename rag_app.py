@@ -7,18 +7,20 @@ from threading import Thread
 import requests
 import os
 import shutil
-from typing import Callable, Optional, List
+from typing import Callable, Optional, List, Tuple
 
 from rag_utils import (
     ingest_pdf, ingest_directory, delete_pdf, get_indexed_pdfs,
-    query_rag, CHROMA_COLLECTION, QUERY_TOP_K
+    query_rag, stream_ollama, OLLAMA_SESSION, CHROMA_COLLECTION, QUERY_TOP_K
 )
 
 # Configuration
 OLLAMA_URL = 'http://localhost:11434/api/generate'
 MODEL_NAME = 'llama2'
 PDF_DIR = 'sample_pdfs'
-
+PROMPT_TEMPLATE = """You are an AI assistant with access to the following document excerpts:\n\n{context}\n\nUsing ONLY this information, answer the following question as accurately as possible:\n\nQuestion: {question}\nAnswer:"""
+# Follow-up sent with Ollama's token `context` when retrieval returns the same excerpts
+FOLLOWUP_TEMPLATE = """\n\nUsing ONLY the document excerpts above, answer the following question as accurately as possible:\n\nQuestion: {question}\nAnswer:"""
 
 class RAGApplication:
     def __init__(self, root: tk.Tk):
@@ -30,6 +32,10 @@ class RAGApplication:
         self.is_ingesting = False
         self.is_querying = False
         
+        # Ollama token context from the last answer, and the excerpts it was built on
+        self.llm_context: Optional[List[int]] = None
+        self.llm_context_chunks: Optional[Tuple[str, ...]] = None
+        
         self.setup_ui()
         self.refresh_pdf_list()
     
@@ -107,9 +113,8 @@ class RAGApplication:
         self.context_area.insert(tk.END, "[Context chunks will appear here]\n")
     
     def update_status(self, message: str, color: str = "black"):
-        """Update status label."""
-        self.status_label.config(text=message, fg=color)
-        self.root.update_idletasks()
+        """Update status label (scheduled on the Tk main loop, safe from worker threads)."""
+        self.root.after(0, lambda: self.status_label.config(text=message, fg=color))
     
     def refresh_pdf_list(self):
         """Refresh the list of indexed PDFs."""
@@ -138,9 +143,22 @@ class RAGApplication:
         # Ensure PDF directory exists
         os.makedirs(PDF_DIR, exist_ok=True)
         
-        # Copy file to PDF directory
+        # Register file in PDF directory: nothing to do if it is already there,
+        # hardlink when on the same filesystem, full copy otherwise. Both go to a
+        # temp name first and replace dest_path, so an existing dest (possibly a
+        # hardlink to another of the user's files) is never written through.
         try:
-            shutil.copy2(file_path, dest_path)
+            if not (os.path.exists(dest_path) and os.path.samefile(file_path, dest_path)):
+                tmp_path = os.path.join(PDF_DIR, f".{filename}.{os.getpid()}.tmp")
+                try:
+                    try:
+                        os.link(file_path, tmp_path)
+                    except OSError:
+                        shutil.copy2(file_path, tmp_path)
+                    os.replace(tmp_path, dest_path)
+                finally:
+                    if os.path.exists(tmp_path):
+                        os.remove(tmp_path)
         except Exception as e:
             messagebox.showerror("Error", f"Failed to copy file: {str(e)}")
             return
@@ -240,20 +258,32 @@ class RAGApplication:
                 _, context_chunks, metadatas = query_rag(question, QUERY_TOP_K)
                 context = '\n'.join(context_chunks) if context_chunks else "[No context found]"
                 
-                # Build prompt for LLM
-                prompt = f"""You are an AI assistant with access to the following document excerpts:\n\n{context}\n\nUsing ONLY this information, answer the following question as accurately as possible:\n\nQuestion: {question}\nAnswer:"""
+                # Build prompt for LLM; if the excerpts are the same as last time, continue
+                # from Ollama's token context instead of re-sending and re-tokenizing them
+                retrieved = tuple(context_chunks)
+                if self.llm_context and retrieved == self.llm_context_chunks:
+                    prompt = FOLLOWUP_TEMPLATE.format_map({'question': question})
+                    llm_context = self.llm_context
+                else:
+                    prompt = PROMPT_TEMPLATE.format_map({'context': context, 'question': question})
+                    llm_context = None
                 
-                # Query Ollama
-                payload = {"model": MODEL_NAME, "prompt": prompt, "stream": False}
-                resp = requests.post(OLLAMA_URL, json=payload, timeout=300)
-                data = resp.json()
-                answer = data.get('response', '[No answer received]').strip()
+                # Query Ollama, rendering tokens as they arrive
+                self.root.after(0, lambda: self.answer_area.delete('1.0', tk.END))
+                answer, self.llm_context = stream_ollama(
+                    OLLAMA_URL, MODEL_NAME, prompt, lambda token: self.root.after(0, self.append_answer, token),
+                    llm_context
+                )
+                self.llm_context_chunks = retrieved
+                answer = answer.strip() or '[No answer received]'
                 
                 # Format context with sources
-                context_with_sources = ""
-                for i, (chunk, meta) in enumerate(zip(context_chunks, metadatas), 1):
-                    source = meta.get('source', 'Unknown') if meta else 'Unknown'
-                    context_with_sources += f"[{i}] Source: {source}\n{chunk}\n\n{'='*50}\n\n"
+                separator = '=' * 50
+                context_with_sources = ''.join([
+                    f"[{i}] Source: {meta.get('source', 'Unknown') if meta else 'Unknown'}\n"
+                    f"{chunk}\n\n{separator}\n\n"
+                    for i, (chunk, meta) in enumerate(zip(context_chunks, metadatas), 1)
+                ])
                 
                 self.root.after(0, lambda: self.on_query_complete(answer, context_with_sources, True, None))
             except requests.exceptions.RequestException as e:
@@ -265,6 +295,11 @@ class RAGApplication:
         
         Thread(target=query_thread, daemon=True).start()
     
+    def append_answer(self, token: str):
+        """Append a streamed answer fragment."""
+        self.answer_area.insert(tk.END, token)
+        self.answer_area.see(tk.END)
+    
     def on_query_complete(self, answer: str, context: str, success: bool, error: Optional[str]):
         """Handle completion of RAG query."""
         self.is_querying = False
@@ -286,7 +321,7 @@ def main():
     """Main entry point for the application."""
     # Check if Ollama is running
     try:
-        requests.get('http://localhost:11434/api/tags', timeout=2)
+        OLLAMA_SESSION.get('http://localhost:11434/api/tags', timeout=2)
     except requests.exceptions.RequestException:
         result = messagebox.askokcancel(
             "Ollama Not Running",
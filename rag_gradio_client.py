@@ -2,41 +2,68 @@
 Gradio-based remote client for the FastAPI RAG server.
 Run this on any machine that can reach the backend server.
 """
+import json
 import os
-from typing import Tuple
+from typing import Any, Iterator, Tuple
 
-import gradio as gr
 import requests
 
 BACKEND_URL = os.environ.get("RAG_BACKEND_URL", "http://localhost:8000")
-QUERY_ENDPOINT = f"{BACKEND_URL.rstrip('/')}/query"
+QUERY_STREAM_ENDPOINT = f"{BACKEND_URL.rstrip('/')}/query/stream"
 UPLOAD_ENDPOINT = f"{BACKEND_URL.rstrip('/')}/upload"
 LIST_ENDPOINT = f"{BACKEND_URL.rstrip('/')}/pdfs"
 DELETE_ENDPOINT_TEMPLATE = f"{BACKEND_URL.rstrip('/')}/pdfs/{{filename}}"
 
 
-def ask_question(question: str) -> Tuple[str, str]:
-    """Send a question to the backend and return answer + context."""
+def ask_question(question: str) -> Iterator[Tuple[str, str]]:
+    """
+    Send a question to the backend's streaming endpoint and yield
+    (answer so far, context) as server-sent events arrive.
+    """
     if not question.strip():
-        return "Please enter a question.", ""
+        yield "Please enter a question.", ""
+        return
+    answer = ""
+    context_text = ""
     try:
-        resp = requests.post(
-            QUERY_ENDPOINT,
+        with requests.post(
+            QUERY_STREAM_ENDPOINT,
             json={"question": question},
+            stream=True,
             timeout=120,
-        )
-        resp.raise_for_status()
-        data = resp.json()
-        answer = data.get("answer", "[No answer returned]")
-        context_chunks = data.get("context", [])
-        context_text = "\n\n---\n\n".join(context_chunks) if context_chunks else "[No context returned]"
-        return answer, context_text
+        ) as resp:
+            resp.raise_for_status()
+            event = "message"
+            for line in resp.iter_lines(decode_unicode=True):
+                if not line:
+                    event = "message"
+                    continue
+                if line.startswith("event:"):
+                    event = line[len("event:"):].strip()
+                    continue
+                if not line.startswith("data:"):
+                    continue
+                data = json.loads(line[len("data:"):])
+                if event == "context":
+                    context_chunks = data.get("context", [])
+                    context_text = "\n\n---\n\n".join(context_chunks) if context_chunks else "[No context returned]"
+                    yield answer, context_text
+                elif event == "error":
+                    yield f"{answer}\n[ERROR] {data.get('detail', 'Generation failed')}", context_text
+                    return
+                elif event == "done":
+                    break
+                else:
+                    answer += data.get("token", "")
+                    yield answer, context_text
+        if not answer:
+            yield "[No answer returned]", context_text
     except requests.RequestException as exc:
-        return f"[ERROR] {exc}", ""
+        yield f"[ERROR] {exc}", context_text
 
 
-def upload_pdf(file: gr.File) -> str:
-    """Upload a PDF file to the backend for ingestion."""
+def upload_pdf(file: Any) -> str:
+    """Upload a PDF file (Gradio file object) to the backend for ingestion."""
     if file is None:
         return "No file selected."
     if not file.name.lower().endswith(".pdf"):
@@ -86,32 +113,42 @@ def delete_pdf(filename: str) -> str:
         return f"[ERROR] {exc}"
 
 
-with gr.Blocks(title="Remote RAG Client") as demo:
-    gr.Markdown("## Remote RAG Client\nConnects to a FastAPI backend serving the PDF knowledge base.")
+def build_demo():
+    """Build the Gradio UI (gradio is imported here to keep module import light)."""
+    import gradio as gr
 
-    with gr.Tab("Ask a Question"):
-        question = gr.Textbox(label="Question", placeholder="Ask something about your PDFs...", lines=2)
-        answer = gr.Textbox(label="Answer", lines=6)
-        context = gr.Textbox(label="Context (Top Chunks)", lines=10)
-        ask_button = gr.Button("Ask", variant="primary")
+    with gr.Blocks(title="Remote RAG Client") as demo:
+        gr.Markdown("## Remote RAG Client\nConnects to a FastAPI backend serving the PDF knowledge base.")
 
-        ask_button.click(fn=ask_question, inputs=question, outputs=[answer, context])
+        with gr.Tab("Ask a Question"):
+            question = gr.Textbox(label="Question", placeholder="Ask something about your PDFs...", lines=2)
+            answer = gr.Textbox(label="Answer", lines=6)
+            context = gr.Textbox(label="Context (Top Chunks)", lines=10)
+            ask_button = gr.Button("Ask", variant="primary")
 
-    with gr.Tab("Manage PDFs"):
-        file_input = gr.File(label="Upload PDF", file_types=[".pdf"])
-        upload_status = gr.Textbox(label="Upload Status")
-        upload_button = gr.Button("Upload & Ingest")
-        upload_button.click(fn=upload_pdf, inputs=file_input, outputs=upload_status)
+            ask_button.click(fn=ask_question, inputs=question, outputs=[answer, context])
 
-        list_button = gr.Button("Refresh Indexed PDFs")
-        pdf_list_output = gr.Textbox(label="Indexed PDFs", lines=8)
-        list_button.click(fn=refresh_pdf_list, outputs=pdf_list_output)
+        with gr.Tab("Manage PDFs"):
+            file_input = gr.File(label="Upload PDF", file_types=[".pdf"])
+            upload_status = gr.Textbox(label="Upload Status")
+            upload_button = gr.Button("Upload & Ingest")
+            upload_button.click(fn=upload_pdf, inputs=file_input, outputs=upload_status)
 
-        delete_name = gr.Textbox(label="PDF filename to delete (exact match)", lines=1)
-        delete_status = gr.Textbox(label="Delete Status")
-        delete_button = gr.Button("Delete PDF", variant="stop")
-        delete_button.click(fn=delete_pdf, inputs=delete_name, outputs=delete_status)
+            list_button = gr.Button("Refresh Indexed PDFs")
+            pdf_list_output = gr.Textbox(label="Indexed PDFs", lines=8)
+            list_button.click(fn=refresh_pdf_list, outputs=pdf_list_output)
 
-if __name__ == "__main__":
-    demo.launch(share=True)
+            delete_name = gr.Textbox(label="PDF filename to delete (exact match)", lines=1)
+            delete_status = gr.Textbox(label="Delete Status")
+            delete_button = gr.Button("Delete PDF", variant="stop")
+            delete_button.click(fn=delete_pdf, inputs=delete_name, outputs=delete_status)
+
+    return demo
 
+
+def main():
+    build_demo().launch(share=True)
+
+
+if __name__ == "__main__":
+    main()
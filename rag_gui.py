@@ -1,95 +1,140 @@
+import functools
 import tkinter as tk
 from tkinter import scrolledtext
 from threading import Thread
-from sentence_transformers import SentenceTransformer
 import chromadb
-import requests
+import numpy as np
 
 CHROMA_COLLECTION = 'rag_pdf_collection'
 OLLAMA_URL = 'http://localhost:11434/api/generate'
 MODEL_NAME = 'llama2'
 CHROMA_PATH = 'chromadb_store'
 QUERY_TOP_K = 3
+PROMPT_TEMPLATE = """
+    You are an AI assistant with access to the following document excerpts:\n\n
+    {context}\n\n
+    Using ONLY this information, answer the following question as accurately as possible:\n\n
+    Question: {question}\n
+    Answer:"""
+
+# Models are loaded by load_models() so importing this module stays cheap
+embedder = None
+collection = None
+
+def load_models():
+    """Load the embedder and open the collection once (GPU + fp16 when available)."""
+    global embedder, collection
+    import torch
+    from sentence_transformers import SentenceTransformer
+
+    device = 'cuda' if torch.cuda.is_available() else 'cpu'
+    embedder = SentenceTransformer('all-MiniLM-L6-v2', device=device)
+    if device == 'cuda':
+        embedder.half()
+    client = chromadb.PersistentClient(path=CHROMA_PATH)
+    try:
+        # Direct lookup; avoids loading every collection via list_collections()
+        collection = client.get_collection(CHROMA_COLLECTION)
+    except Exception as e:
+        raise ValueError(f"Collection '{CHROMA_COLLECTION}' not found. Run ingest_pdfs.py first.") from e
 
-# Load models once
-embedder = SentenceTransformer('all-MiniLM-L6-v2')
-client = chromadb.PersistentClient(path=CHROMA_PATH)
-existing = [c.name for c in client.list_collections()]
-if CHROMA_COLLECTION in existing:
-    collection = client.get_collection(CHROMA_COLLECTION)
-else:
-    raise ValueError(f"Collection '{CHROMA_COLLECTION}' not found. Run ingest_pdfs.py first.")
-
-def run_query(question, update_fn):
-    query_emb = embedder.encode([question])[0]
-    results = collection.query(
-        query_embeddings=[query_emb],
+@functools.lru_cache(maxsize=256)
+def encode_query(key):
+    # fp16 bytes keep the cache small; MiniLM is uncased so lowercasing is lossless
+    return embedder.encode([key], normalize_embeddings=True)[0].astype(np.float16).tobytes()
+
+@functools.lru_cache(maxsize=256)
+def search(emb_bytes):
+    # Cached per embedding; re-run ingest_pdfs.py and restart the GUI to pick up new PDFs
+    query_emb = np.frombuffer(emb_bytes, dtype=np.float16).astype(np.float32)
+    return collection.query(
+        query_embeddings=[query_emb.tolist()],
         n_results=QUERY_TOP_K,
         include=['documents', 'metadatas']
     )
+
+def run_query(question, token_fn, update_fn):
+    results = search(encode_query(question.strip().lower()))
     context_chunks = results['documents'][0]
     context = '\n'.join(context_chunks)
-    prompt = f"""
-    You are an AI assistant with access to the following document excerpts:\n\n
-    {context}\n\n
-    Using ONLY this information, answer the following question as accurately as possible:\n\n
-    Question: {question}\n
-    Answer:"""
-    
-    payload = {"model": MODEL_NAME, "prompt": prompt, "stream": False}
+    prompt = PROMPT_TEMPLATE.format_map({'context': context, 'question': question})
+    # Imported here, like the models, so importing this module stays cheap
+    from rag_utils import stream_ollama
+
     try:
-        resp = requests.post(OLLAMA_URL, json=payload, timeout=300)
-        data = resp.json()
-        answer = data.get('response', '[No answer received]')
+        answer = stream_ollama(OLLAMA_URL, MODEL_NAME, prompt, token_fn)[0] or '[No answer received]'
     except Exception as e:
         answer = "[ERROR] " + str(e)
     update_fn(answer.strip(), context.strip())
 
-# GUI
-root = tk.Tk()
-root.title("RAG PDF Chat")
-root.geometry('700x500')
-
-frame = tk.Frame(root)
-frame.pack(pady=10)
-
-lbl = tk.Label(frame, text="Ask a question based on your PDFs:")
-lbl.pack()
-
-entry = tk.Entry(frame, width=60, font=("Arial", 14))
-entry.pack(padx=10, pady=5)
-
-result_area = scrolledtext.ScrolledText(root, wrap=tk.WORD, height=12, font=("Arial", 12))
-result_area.pack(padx=10, pady=5, fill='both', expand=True)
-
-context_area = scrolledtext.ScrolledText(root, wrap=tk.WORD, height=12, font=("Arial", 12), bg="#f9f5e3")
-context_area.pack(padx=10, pady=5, fill='both', expand=True)
-context_area.insert(tk.END, "\n[Context Chunks Will Show Here]")
-context_area.config(state='disabled')
-
-def ask():
-    q = entry.get().strip()
-    if not q:
-        result_area.insert(tk.END, "\n[Please enter a question.]\n")
-        return
-    result_area.delete('1.0', tk.END)
-    result_area.insert(tk.END, "Answering... This may take a moment.\n")
-    context_area.config(state='normal')
-    context_area.delete('1.0', tk.END)
-    context_area.insert(tk.END, "[Loading context...]")
+def main():
+    load_models()
+
+    # GUI
+    root = tk.Tk()
+    root.title("RAG PDF Chat")
+    root.geometry('700x500')
+
+    frame = tk.Frame(root)
+    frame.pack(pady=10)
+
+    lbl = tk.Label(frame, text="Ask a question based on your PDFs:")
+    lbl.pack()
+
+    entry = tk.Entry(frame, width=60, font=("Arial", 14))
+    entry.pack(padx=10, pady=5)
+
+    result_area = scrolledtext.ScrolledText(root, wrap=tk.WORD, height=12, font=("Arial", 12))
+    result_area.pack(padx=10, pady=5, fill='both', expand=True)
+
+    context_area = scrolledtext.ScrolledText(root, wrap=tk.WORD, height=12, font=("Arial", 12), bg="#f9f5e3")
+    context_area.pack(padx=10, pady=5, fill='both', expand=True)
+    context_area.insert(tk.END, "\n[Context Chunks Will Show Here]")
     context_area.config(state='disabled')
 
-    def update(answer, context):
+    def ask():
+        q = entry.get().strip()
+        if not q:
+            result_area.insert(tk.END, "\n[Please enter a question.]\n")
+            return
         result_area.delete('1.0', tk.END)
-        result_area.insert(tk.END, answer + '\n')
+        result_area.insert(tk.END, "Answering... This may take a moment.\n")
         context_area.config(state='normal')
         context_area.delete('1.0', tk.END)
-        context_area.insert(tk.END, context)
+        context_area.insert(tk.END, "[Loading context...]")
         context_area.config(state='disabled')
 
-    Thread(target=run_query, args=(q, update), daemon=True).start()
+        started = []
+
+        def append_token(token):
+            if not started:
+                started.append(True)
+                result_area.delete('1.0', tk.END)
+            result_area.insert(tk.END, token)
+            result_area.see(tk.END)
+
+        def show(answer, context):
+            result_area.delete('1.0', tk.END)
+            result_area.insert(tk.END, answer + '\n')
+            context_area.config(state='normal')
+            context_area.delete('1.0', tk.END)
+            context_area.insert(tk.END, context)
+            context_area.config(state='disabled')
+
+        # Worker thread hands updates to the Tk main loop
+        def on_token(token):
+            root.after(0, append_token, token)
+
+        def update(answer, context):
+            root.after(0, show, answer, context)
+
+        Thread(target=run_query, args=(q, on_token, update), daemon=True).start()
+
+    btn = tk.Button(frame, text="Ask", command=ask, font=("Arial", 12))
+    btn.pack(pady=5)
+
+    root.mainloop()
 
-btn = tk.Button(frame, text="Ask", command=ask, font=("Arial", 12))
-btn.pack(pady=5)
 
-root.mainloop()
+if __name__ == "__main__":
+    main()
@@ -1,12 +1,12 @@
 """Command-line RAG query tool."""
 import requests
 import sys
-from rag_utils import query_rag, QUERY_TOP_K
+from rag_utils import query_rag, stream_ollama, QUERY_TOP_K
 
 # Configuration
 OLLAMA_URL = 'http://localhost:11434/api/generate'
 MODEL_NAME = 'llama2'
-
+PROMPT_TEMPLATE = """You are an AI assistant with access to the following document excerpts:\n\n{context}\n\nUsing ONLY this information, answer the following question as accurately as possible:\n\nQuestion: {question}\nAnswer:"""
 
 def main():
     """Main entry point for command-line queries."""
@@ -22,16 +22,15 @@ def main():
         context = '\n'.join(context_chunks) if context_chunks else "[No context found]"
         
         # Build prompt for LLM
-        prompt = f"""You are an AI assistant with access to the following document excerpts:\n\n{context}\n\nUsing ONLY this information, answer the following question as accurately as possible:\n\nQuestion: {question}\nAnswer:"""
+        prompt = PROMPT_TEMPLATE.format_map({'context': context, 'question': question})
         
         # Query Ollama
-        payload = {"model": MODEL_NAME, "prompt": prompt, "stream": False}
-        response = requests.post(OLLAMA_URL, json=payload, timeout=300)
-        data = response.json()
-        answer = data.get('response', '[No answer received]')
-        
         print("\n=== RAG Answer ===\n")
-        print(answer)
+        answer, _ = stream_ollama(OLLAMA_URL, MODEL_NAME, prompt,
+                                  lambda token: print(token, end='', flush=True))
+        if not answer:
+            print('[No answer received]', end='')
+        print()
     except requests.exceptions.RequestException as e:
         print(f"\n[ERROR] Failed to connect to Ollama. Make sure Ollama is running.\n{str(e)}")
         sys.exit(1)
@@ -4,16 +4,29 @@ can interact with the knowledge base and Llama 2/Ollama backend.
 """
 from __future__ import annotations
 
+import asyncio
+import io
+import json
+from contextlib import asynccontextmanager
 import os
 import shutil
-from typing import List, Optional
+import threading
+from typing import BinaryIO, List, Optional
 
-import requests
+import httpx
 from fastapi import FastAPI, HTTPException, UploadFile, File
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 
+try:
+    import orjson  # optional: faster encoding/decoding of Ollama request/response bodies
+except ImportError:
+    orjson = None
+
 from rag_utils import (
+    get_embedder,
+    get_vector_store,
     ingest_pdf,
     ingest_directory,
     delete_pdf,
@@ -27,6 +40,22 @@ PDF_DIR = os.environ.get("RAG_PDF_DIR", "sample_pdfs")
 OLLAMA_URL = os.environ.get("OLLAMA_URL", "http://localhost:11434/api/generate")
 MODEL_NAME = os.environ.get("OLLAMA_MODEL", "llama2")
 DEFAULT_TOP_K = int(os.environ.get("RAG_QUERY_TOP_K", QUERY_TOP_K))
+# How long Ollama keeps the model loaded after a request
+OLLAMA_KEEP_ALIVE = os.environ.get("OLLAMA_KEEP_ALIVE", "30m")
+OLLAMA_MAX_CONNECTIONS = 16
+# Sent as Ollama's "system" field: identical on every call, so its KV cache
+# is reused instead of re-prefilling the instructions per question
+SYSTEM_PROMPT = (
+    "You are an AI assistant with access to document excerpts supplied with each question. "
+    "Using ONLY that information, answer the question as accurately as possible."
+)
+PROMPT_TEMPLATE = (
+    "Document excerpts:\n\n"
+    "{context}\n\n"
+    "Question: {question}\nAnswer:"
+)
+NO_CONTEXT_ANSWER = "Could not find relevant context for the question."
+JSON_HEADERS = {"Content-Type": "application/json"}
 
 
 class QueryRequest(BaseModel):
@@ -61,7 +90,112 @@ def ensure_pdf_dir() -> str:
     return PDF_DIR
 
 
-app = FastAPI(title="RAG PDF Server", version="1.0.0")
+COPY_BUFFER_SIZE = 1 << 20
+
+
+def save_upload(src: BinaryIO, dest_path: str) -> None:
+    """
+    Write an uploaded file to dest_path. Uploads that Starlette has already
+    spooled to a temp file are copied in-kernel with os.sendfile; small
+    in-memory uploads (asking those for fileno() would force a disk rollover)
+    use a 1MB-buffered copy. The data goes to a temp file that then replaces
+    dest_path, so an existing dest (which the desktop app may have hardlinked
+    to a user's file) is never truncated in place.
+    """
+    dest_dir, dest_name = os.path.split(dest_path)
+    tmp_path = os.path.join(dest_dir, f".{dest_name}.{os.getpid()}.{threading.get_ident()}.tmp")
+    try:
+        with open(tmp_path, "wb") as out_file:
+            _copy_upload(src, out_file)
+        os.replace(tmp_path, dest_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+def _copy_upload(src: BinaryIO, out_file: BinaryIO) -> None:
+    """
+    Copy src from its current position to the end into out_file for
+    save_upload: os.sendfile when src is backed by a real file, else (or for
+    whatever sendfile stops short of) a COPY_BUFFER_SIZE-buffered copy.
+    """
+    # A SpooledTemporaryFile still held in memory would roll over to disk on fileno()
+    in_memory = isinstance(getattr(src, "_file", None), io.BytesIO)
+    if not in_memory and hasattr(os, "sendfile"):
+        try:
+            in_fd = src.fileno()
+        except (AttributeError, OSError, io.UnsupportedOperation):
+            in_fd = None
+        if in_fd is not None:
+            offset = src.tell()
+            remaining = os.fstat(in_fd).st_size - offset
+            while remaining > 0:
+                sent = os.sendfile(out_file.fileno(), in_fd, offset, remaining)
+                if sent == 0:
+                    break
+                offset += sent
+                remaining -= sent
+            if remaining <= 0:
+                return
+            # sendfile stopped early: copy the rest so dest is never left truncated
+            src.seek(offset)
+    shutil.copyfileobj(src, out_file, length=COPY_BUFFER_SIZE)
+
+
+def json_dumps(obj) -> bytes:
+    """Serialize obj to UTF-8 JSON, with orjson when available."""
+    if orjson is not None:
+        return orjson.dumps(obj)
+    return json.dumps(obj, ensure_ascii=False).encode("utf-8")
+
+
+def json_loads(data: bytes):
+    """Parse JSON bytes, with orjson when available."""
+    return orjson.loads(data) if orjson is not None else json.loads(data)
+
+
+def ollama_request(context_chunks: List[str], question: str, stream: bool) -> bytes:
+    """Encoded /api/generate body for answering question from context_chunks."""
+    context_text = "\n".join(context_chunks)
+    prompt = PROMPT_TEMPLATE.format_map({"context": context_text, "question": question})
+    return json_dumps({
+        "model": MODEL_NAME,
+        "system": SYSTEM_PROMPT,
+        "prompt": prompt,
+        "stream": stream,
+        "keep_alive": OLLAMA_KEEP_ALIVE,
+    })
+
+
+def source_names(metadatas: List[dict]) -> List[str]:
+    """Source filename of each retrieved chunk."""
+    return [meta.get("source", "Unknown") if meta else "Unknown" for meta in metadatas]
+
+
+def sse_event(data: dict, event: Optional[str] = None) -> bytes:
+    """Encode one server-sent event."""
+    prefix = f"event: {event}\n".encode("utf-8") if event else b""
+    return prefix + b"data: " + json_dumps(data) + b"\n\n"
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """
+    Load the embedder and open the search backend before serving the first
+    request, and share one async HTTP client for Ollama across requests.
+    """
+    get_embedder()
+    get_vector_store()
+    limits = httpx.Limits(
+        max_connections=OLLAMA_MAX_CONNECTIONS,
+        max_keepalive_connections=OLLAMA_MAX_CONNECTIONS,
+    )
+    async with httpx.AsyncClient(timeout=300, limits=limits) as http:
+        app.state.http = http
+        yield
+
+
+app = FastAPI(title="RAG PDF Server", version="1.0.0", lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -86,7 +220,7 @@ def list_pdfs():
 
 
 @app.post("/upload", response_model=StatusResponse)
-def upload_pdf(file: UploadFile = File(...)):
+async def upload_pdf(file: UploadFile = File(...)):
     """Upload and ingest a PDF."""
     if file.content_type != "application/pdf":
         raise HTTPException(status_code=400, detail="Only PDF files are supported")
@@ -95,14 +229,13 @@ def upload_pdf(file: UploadFile = File(...)):
     dest_path = os.path.join(PDF_DIR, file.filename)
 
     try:
-        with open(dest_path, "wb") as out_file:
-            shutil.copyfileobj(file.file, out_file)
+        await asyncio.to_thread(save_upload, file.file, dest_path)
     except OSError as exc:
         raise HTTPException(status_code=500, detail=f"Failed to save file: {exc}") from exc
     finally:
-        file.file.close()
+        await file.close()
 
-    success, message, _ = ingest_pdf(dest_path, PDF_DIR)
+    success, message, _ = await asyncio.to_thread(ingest_pdf, dest_path, PDF_DIR)
     if not success:
         raise HTTPException(status_code=500, detail=message)
 
@@ -119,10 +252,10 @@ def delete_pdf_endpoint(filename: str):
 
 
 @app.post("/reingest", response_model=ReingestResponse)
-def reingest_all_endpoint():
-    """Re-ingest all PDFs from the directory."""
+def reingest_all_endpoint(force: bool = False):
+    """Re-ingest all PDFs from the directory (?force=true ignores unchanged-file skips)."""
     ensure_pdf_dir()
-    success_count, failure_count, messages = ingest_directory(PDF_DIR)
+    success_count, failure_count, messages = ingest_directory(PDF_DIR, force)
     return ReingestResponse(
         success_count=success_count,
         failure_count=failure_count,
@@ -130,48 +263,42 @@ def reingest_all_endpoint():
     )
 
 
-@app.post("/query", response_model=QueryResponse)
-def query_endpoint(payload: QueryRequest):
-    """Answer a question using the RAG pipeline and Ollama."""
+async def retrieve(payload: QueryRequest):
+    """Validate the question and fetch its context: (question, chunks, metadatas)."""
     question = payload.question.strip()
     if not question:
         raise HTTPException(status_code=400, detail="Question cannot be empty")
-
     top_k = payload.top_k or DEFAULT_TOP_K
-
     try:
-        _, context_chunks, metadatas = query_rag(question, top_k)
-        if not context_chunks:
-            return QueryResponse(
-                answer="Could not find relevant context for the question.",
-                context=[],
-                sources=[],
-            )
-
-        context_text = "\n".join(context_chunks)
-        prompt = (
-            "You are an AI assistant with access to the following document excerpts:\n\n"
-            f"{context_text}\n\n"
-            "Using ONLY this information, answer the following question as accurately as possible.\n\n"
-            f"Question: {question}\nAnswer:"
+        # Embedding + vector search are blocking; keep them off the event loop
+        _, context_chunks, metadatas = await asyncio.to_thread(query_rag, question, top_k)
+    except Exception as exc:
+        raise HTTPException(status_code=500, detail=str(exc)) from exc
+    return question, context_chunks, metadatas
+
+
+@app.post("/query", response_model=QueryResponse)
+async def query_endpoint(payload: QueryRequest):
+    """Answer a question using the RAG pipeline and Ollama."""
+    question, context_chunks, metadatas = await retrieve(payload)
+    if not context_chunks:
+        return QueryResponse(
+            answer=NO_CONTEXT_ANSWER,
+            context=[],
+            sources=[],
         )
 
-        response = requests.post(
+    try:
+        response = await app.state.http.post(
             OLLAMA_URL,
-            json={"model": MODEL_NAME, "prompt": prompt, "stream": False},
-            timeout=300,
+            content=ollama_request(context_chunks, question, stream=False),
+            headers=JSON_HEADERS,
         )
         response.raise_for_status()
-        data = response.json()
+        data = json_loads(response.content)
         answer = data.get("response", "[No answer received]").strip()
-
-        sources = []
-        for meta in metadatas:
-            src = meta.get("source", "Unknown") if meta else "Unknown"
-            sources.append(src)
-
-        return QueryResponse(answer=answer, context=context_chunks, sources=sources)
-    except requests.RequestException as exc:
+        return QueryResponse(answer=answer, context=context_chunks, sources=source_names(metadatas))
+    except httpx.HTTPError as exc:
         raise HTTPException(
             status_code=502,
             detail=f"Failed to connect to Ollama at {OLLAMA_URL}: {exc}",
@@ -180,6 +307,54 @@ def query_endpoint(payload: QueryRequest):
         raise HTTPException(status_code=500, detail=str(exc)) from exc
 
 
+@app.post("/query/stream")
+async def query_stream_endpoint(payload: QueryRequest):
+    """
+    Answer a question as server-sent events: a "context" event with the
+    retrieved chunks and sources, one {"token": ...} data event per generated
+    token, then "done" (or "error" if Ollama fails mid-answer).
+    """
+    question, context_chunks, metadatas = await retrieve(payload)
+
+    async def events():
+        yield sse_event({"context": context_chunks, "sources": source_names(metadatas)}, "context")
+        if not context_chunks:
+            yield sse_event({"token": NO_CONTEXT_ANSWER})
+            yield sse_event({}, "done")
+            return
+        try:
+            async with app.state.http.stream(
+                "POST",
+                OLLAMA_URL,
+                content=ollama_request(context_chunks, question, stream=True),
+                headers=JSON_HEADERS,
+            ) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line:
+                        continue
+                    data = json_loads(line)
+                    token = data.get("response", "")
+                    if token:
+                        yield sse_event({"token": token})
+                    if data.get("done"):
+                        break
+        except httpx.HTTPError as exc:
+            yield sse_event({"detail": f"Failed to connect to Ollama at {OLLAMA_URL}: {exc}"}, "error")
+            return
+        except Exception as exc:
+            # Headers are already sent, so report e.g. a malformed Ollama line in-band
+            yield sse_event({"detail": f"Ollama streaming failed: {exc}"}, "error")
+            return
+        yield sse_event({}, "done")
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache"},
+    )
+
+
 if __name__ == "__main__":
     import uvicorn
 
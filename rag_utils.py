@@ -1,39 +1,244 @@
 """
 Utility functions for RAG pipeline: PDF processing, ingestion, and querying.
 """
+import hashlib
+import json
+import logging
+import multiprocessing
 import os
-from typing import List, Tuple
+import sqlite3
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import contextmanager, nullcontext
+from typing import Callable, ContextManager, Dict, Iterable, List, Optional, Protocol, Sequence, Tuple, Union
+import numpy as np
+import requests
+import torch
 from pypdf import PdfReader
+from requests.adapters import HTTPAdapter
 from sentence_transformers import SentenceTransformer
 import chromadb
 
+try:
+    import pypdfium2 as pdfium  # optional: much faster C++ (PDFium) text extraction
+except ImportError:
+    pdfium = None
+
+try:
+    import faiss  # optional: only needed for very large collections
+except ImportError:
+    faiss = None
+
+try:
+    import numba  # optional: fused parallel top-k kernel for the flat scan
+except ImportError:
+    numba = None
+
+if numba is not None and not {"NUMBA_THREADING_LAYER", "NUMBA_THREADING_LAYER_PRIORITY"} & set(os.environ):
+    # Prefer OpenMP: it is safe for concurrent callers (workqueue is not), and
+    # TBB can hang at interpreter exit when first started from a worker thread,
+    # which is where the server and the Tk app run queries
+    numba.config.THREADING_LAYER_PRIORITY = ['omp', 'tbb', 'workqueue']
+
+try:
+    import onnxruntime as ort  # optional: int8 ONNX embedder (RAG_EMBED_ONNX)
+    from tokenizers import Tokenizer
+except ImportError:
+    ort = None
+
 # Configuration (environment overrides for container use)
 CHUNK_SIZE = int(os.environ.get("RAG_CHUNK_SIZE", 1500))
 CHUNK_OVERLAP = int(os.environ.get("RAG_CHUNK_OVERLAP", 400))
 CHROMA_COLLECTION = os.environ.get("CHROMA_COLLECTION", "rag_pdf_collection")
 CHROMA_PATH = os.environ.get("CHROMA_PATH", "chromadb_store")
 QUERY_TOP_K = int(os.environ.get("RAG_QUERY_TOP_K", 3))
+EMBED_MODEL = 'all-MiniLM-L6-v2'
+# sqlite cache of chunk embeddings keyed by content hash; skips re-encoding unchanged text
+EMBED_CACHE_PATH = os.environ.get("RAG_EMBED_CACHE", os.path.join(CHROMA_PATH, "embed_cache.sqlite3"))
+EMBED_BATCH_SIZE = int(os.environ.get("RAG_EMBED_BATCH", 64))
+# Embeddings are normalized to unit length, so inner product ranks exactly like
+# cosine without the per-distance norm computation.
+# M / ef values suit corpora under ~1M chunks; raise search_ef if recall drops.
+COLLECTION_METADATA = {
+    "hnsw:space": "ip",
+    "hnsw:M": int(os.environ.get("RAG_HNSW_M", 16)),
+    "hnsw:construction_ef": int(os.environ.get("RAG_HNSW_CONSTRUCTION_EF", 200)),
+    "hnsw:search_ef": int(os.environ.get("RAG_HNSW_SEARCH_EF", 64)),
+}
 DEFAULT_PDF_DIR = os.environ.get("RAG_PDF_DIR", "sample_pdfs")
+# Text extraction backend: "pypdf" (default) or "pdfium" (needs pypdfium2)
+PDF_BACKEND = os.environ.get("RAG_PDF_BACKEND", "pypdf")
+# Single-PDF ingests split pages across processes for PDFs at least this long
+PDF_PARALLEL_MIN_PAGES = int(os.environ.get("RAG_PDF_PARALLEL_MIN_PAGES", 64))
+# Collections at least this large are served from a FAISS IVF+PQ index (if faiss is installed)
+FAISS_MIN_CHUNKS = int(os.environ.get("RAG_FAISS_MIN_CHUNKS", 1_000_000))
+FAISS_INDEX_FACTORY = os.environ.get("RAG_FAISS_INDEX", "IVF1024,PQ48")
+FAISS_NPROBE = int(os.environ.get("RAG_FAISS_NPROBE", 32))
+FAISS_TRAIN_SAMPLE = 100_000
+# Search backend: "auto" (Chroma, or FAISS above FAISS_MIN_CHUNKS), "chroma", "faiss" or "flat"
+VECTOR_BACKEND = os.environ.get("RAG_VECTOR_BACKEND", "auto")
+FLAT_INDEX_PATH = os.path.join(CHROMA_PATH, "flat_index")
+# Indexed filenames, maintained at ingest/delete time so listing PDFs doesn't scan every chunk
+SOURCES_PATH = os.path.join(CHROMA_PATH, "sources.json")
+# Flat backend: Hamming-prefilter top_k * this many candidates, then rerank them exactly.
+# Off by default (0): sign bits lose a lot of recall, so only enable it with a wide
+# pool (hundreds) after checking recall on your own corpus.
+BINARY_RERANK_FACTOR = int(os.environ.get("RAG_BINARY_RERANK_FACTOR", 0))
+# ...and only once the index has this many rows; below it an exact scan is cheap
+BINARY_MIN_ROWS = int(os.environ.get("RAG_BINARY_MIN_ROWS", 100_000))
+# Flat backend vector precision: "int8" (scalar-quantized), "float16" or "float32"
+FLAT_DTYPE = os.environ.get("RAG_FLAT_DTYPE", "int8")
+# Rows scored per tile of the flat scan (4096 x 384 float32 = 6MB, roughly L2/L3-sized)
+FLAT_SCAN_BLOCK = int(os.environ.get("RAG_FLAT_SCAN_BLOCK", 4096))
+EMBED_DEVICE = os.environ.get("RAG_EMBED_DEVICE", "cuda" if torch.cuda.is_available() else "cpu")
+# Directory holding an ONNX export of EMBED_MODEL (model.int8.onnx or model.onnx,
+# plus tokenizer.json); when set, embeddings run on ONNX Runtime instead of PyTorch.
+# Create it once with:
+#   optimum-cli export onnx --model sentence-transformers/all-MiniLM-L6-v2 onnx_model/
+#   python -c "from onnxruntime.quantization import quantize_dynamic, QuantType; \
+#     quantize_dynamic('onnx_model/model.onnx', 'onnx_model/model.int8.onnx', weight_type=QuantType.QInt8)"
+EMBED_ONNX_PATH = os.environ.get("RAG_EMBED_ONNX", "")
+
+logger = logging.getLogger(__name__)
 
-# Initialize models (lazy loading)
+# Initialize models (lazy loading, double-checked under a lock so concurrent
+# first requests don't each load their own copy)
 _embedder = None
 _client = None
 _collection = None
+_store = None
+_embed_cache = None
+_embedder_lock = threading.Lock()
+_client_lock = threading.Lock()
+_collection_lock = threading.Lock()
+_store_lock = threading.Lock()
+_embed_cache_lock = threading.Lock()  # also serializes cache reads/writes
+_sources_lock = threading.Lock()
+# PDFium is not thread-safe, even across separate documents: every pdfium call
+# in this process goes through this lock (worker processes get a fresh one)
+_pdfium_lock = threading.Lock()
+
+
+def _reset_pdfium_lock() -> None:
+    global _pdfium_lock
+    _pdfium_lock = threading.Lock()
+
+
+# A lock held by another thread at fork time would stay held forever in the child
+os.register_at_fork(after_in_child=_reset_pdfium_lock)
+
+if "forkserver" in multiprocessing.get_all_start_methods():
+    _MP_CONTEXT = multiprocessing.get_context("forkserver")
+    _MP_CONTEXT.set_forkserver_preload([__name__])
+else:
+    _MP_CONTEXT = multiprocessing.get_context("spawn")
+
+
+class OnnxEmbedder:
+    """
+    Drop-in for SentenceTransformer.encode() backed by an ONNX Runtime session
+    (CPU, int8 weights when model.int8.onnx exists). Mean-pools token states
+    over the attention mask, as all-MiniLM-L6-v2 does.
+    """
+
+    def __init__(self, path: str, max_seq_length: int = 256):
+        model_path = onnx_model_path(path)
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        self.session = ort.InferenceSession(model_path, options, providers=['CPUExecutionProvider'])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        self.tokenizer = Tokenizer.from_file(os.path.join(path, 'tokenizer.json'))
+        self.tokenizer.enable_truncation(max_length=max_seq_length)
+        self.tokenizer.enable_padding()  # pad to the longest text in each batch
+
+    def encode(self, sentences: List[str], batch_size: int = 32, show_progress_bar: bool = False,
+               convert_to_numpy: bool = True, normalize_embeddings: bool = False) -> np.ndarray:
+        # Longest first, like sentence-transformers, so each batch pads to similar lengths
+        order = sorted(range(len(sentences)), key=lambda i: -len(sentences[i]))
+        pooled = []
+        for start in range(0, len(order), batch_size):
+            encodings = self.tokenizer.encode_batch([sentences[i] for i in order[start:start + batch_size]])
+            mask = np.array([e.attention_mask for e in encodings], dtype=np.int64)
+            feed = {
+                'input_ids': np.array([e.ids for e in encodings], dtype=np.int64),
+                'attention_mask': mask,
+                'token_type_ids': np.array([e.type_ids for e in encodings], dtype=np.int64),
+            }
+            hidden = self.session.run(None, {k: v for k, v in feed.items() if k in self.input_names})[0]
+            weights = mask[:, :, None].astype(np.float32)
+            pooled.append((hidden * weights).sum(axis=1) / np.maximum(weights.sum(axis=1), 1e-9))
+        if not pooled:
+            return np.empty((0, 0), dtype=np.float32)
+        embeddings = np.empty((len(sentences), pooled[0].shape[1]), dtype=np.float32)
+        embeddings[order] = np.concatenate(pooled)
+        if normalize_embeddings:
+            embeddings /= np.maximum(np.linalg.norm(embeddings, axis=1, keepdims=True), 1e-12)
+        return embeddings
+
+
+def onnx_model_path(path: str) -> str:
+    """The ONNX model OnnxEmbedder loads from path: int8 if exported, else fp32."""
+    model_path = os.path.join(path, 'model.int8.onnx')
+    if not os.path.exists(model_path):
+        model_path = os.path.join(path, 'model.onnx')
+    return model_path
+
+
+def embedder_id() -> str:
+    """
+    Which embedder produces vectors: EMBED_MODEL, or "onnx:<model file>" with
+    RAG_EMBED_ONNX. Part of every embedding cache key, so vectors from the two
+    variants are never mixed.
+    """
+    if EMBED_ONNX_PATH:
+        return f"onnx:{os.path.abspath(onnx_model_path(EMBED_ONNX_PATH))}"
+    return EMBED_MODEL
 
 
-def get_embedder() -> SentenceTransformer:
-    """Get or create the sentence transformer embedder."""
+def get_embedder() -> Union[SentenceTransformer, OnnxEmbedder]:
+    """
+    Get or create the embedder: the sentence transformer, or an OnnxEmbedder
+    when RAG_EMBED_ONNX points at an exported model.
+    """
     global _embedder
     if _embedder is None:
-        _embedder = SentenceTransformer('all-MiniLM-L6-v2')
+        with _embedder_lock:
+            if _embedder is None and EMBED_ONNX_PATH:
+                if ort is None:
+                    raise ValueError("RAG_EMBED_ONNX requires the onnxruntime and tokenizers packages")
+                _embedder = OnnxEmbedder(EMBED_ONNX_PATH)
+            if _embedder is None:
+                embedder = SentenceTransformer(EMBED_MODEL, device=EMBED_DEVICE)
+                if EMBED_DEVICE.startswith('cuda'):
+                    embedder.half()
+                embedder.max_seq_length = 256
+                _embedder = embedder
     return _embedder
 
 
+def get_embed_cache() -> sqlite3.Connection:
+    """Get or open the sqlite embedding cache."""
+    global _embed_cache
+    if _embed_cache is None:
+        with _embed_cache_lock:
+            if _embed_cache is None:
+                os.makedirs(os.path.dirname(EMBED_CACHE_PATH) or '.', exist_ok=True)
+                cache = sqlite3.connect(EMBED_CACHE_PATH, check_same_thread=False)
+                cache.execute(
+                    "CREATE TABLE IF NOT EXISTS embeddings "
+                    "(key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+                )
+                _embed_cache = cache
+    return _embed_cache
+
+
 def get_client() -> chromadb.PersistentClient:
     """Get or create the ChromaDB client."""
     global _client
     if _client is None:
-        _client = chromadb.PersistentClient(path=CHROMA_PATH)
+        with _client_lock:
+            if _client is None:
+                _client = chromadb.PersistentClient(path=CHROMA_PATH)
     return _client
 
 
@@ -41,107 +246,762 @@ def get_collection() -> chromadb.Collection:
     """Get or create the ChromaDB collection."""
     global _collection
     if _collection is None:
-        client = get_client()
-        existing = [c.name for c in client.list_collections()]
-        if CHROMA_COLLECTION in existing:
-            _collection = client.get_collection(CHROMA_COLLECTION)
-        else:
-            _collection = client.create_collection(CHROMA_COLLECTION)
+        with _collection_lock:
+            if _collection is None:
+                # metadata only applies when the collection is first created
+                _collection = get_client().get_or_create_collection(
+                    CHROMA_COLLECTION, metadata=COLLECTION_METADATA
+                )
     return _collection
 
 
-def read_pdf(file_path: str) -> str:
-    """Extract text from a PDF file."""
-    try:
+class VectorStore(Protocol):
+    """Backend used for chunk storage and nearest-neighbour search."""
+
+    def add(self, ids: List[str], embeddings: np.ndarray,
+            documents: List[str], metadatas: List[dict]) -> None: ...
+
+    def delete_source(self, filename: str, count: bool = False) -> Optional[int]: ...
+
+    def query(self, embedding: np.ndarray, k: int) -> Tuple[List[str], List[dict]]: ...
+
+    def batch(self) -> ContextManager[None]:
+        """Group several add/delete_source calls so on-disk state is written once."""
+        ...
+
+
+# Bits set per byte value (fallback when numpy lacks bitwise_count, i.e. < 2.0)
+_POPCOUNT8 = np.unpackbits(np.arange(256, dtype=np.uint8)[:, None], axis=1).sum(axis=1).astype(np.uint8)
+
+
+def hamming_distances(signatures: np.ndarray, query_signature: np.ndarray) -> np.ndarray:
+    """Hamming distance from each packed-bit row of signatures to query_signature."""
+    diff = np.bitwise_xor(signatures, query_signature)
+    if hasattr(np, 'bitwise_count'):
+        if diff.shape[1] % 8 == 0:
+            diff = np.ascontiguousarray(diff).view(np.uint64)  # 8 bytes per popcount
+        return np.bitwise_count(diff).sum(axis=1, dtype=np.int32)
+    return _POPCOUNT8[diff].sum(axis=1, dtype=np.int32)
+
+
+if numba is not None:
+    # Reassociation/contraction let the dot product vectorize; full fastmath
+    # would also assume no infinities, but the buffers are seeded with -inf
+    @numba.njit(parallel=True, fastmath={'reassoc', 'contract'}, cache=True)
+    def _numba_top_k(matrix, query, k, n_blocks):
+        """
+        Per-block top-k of matrix @ query in a single pass: each of n_blocks
+        parallel row ranges keeps a sorted length-k buffer, so the score
+        vector is never materialized. Returns the concatenated block buffers.
+        """
+        n, dim = matrix.shape
+        step = (n + n_blocks - 1) // n_blocks
+        best_scores = np.full((n_blocks, k), -np.inf, dtype=np.float32)
+        best_idx = np.full((n_blocks, k), -1, dtype=np.int64)
+        for b in numba.prange(n_blocks):
+            scores = best_scores[b]
+            idx = best_idx[b]
+            for i in range(b * step, min(n, (b + 1) * step)):
+                s = np.float32(0.0)
+                for d in range(dim):
+                    s += matrix[i, d] * query[d]
+                if s > scores[k - 1]:
+                    j = k - 1
+                    while j > 0 and scores[j - 1] < s:
+                        scores[j] = scores[j - 1]
+                        idx[j] = idx[j - 1]
+                        j -= 1
+                    scores[j] = s
+                    idx[j] = i
+        return best_scores.ravel(), best_idx.ravel()
+
+
+def top_k_scan(matrix: np.ndarray, query: np.ndarray, k: int,
+               block: int = FLAT_SCAN_BLOCK) -> np.ndarray:
+    """
+    Row indices of the k largest matrix @ query scores, best first. With numba
+    installed, int8/float32 matrices go through the fused _numba_top_k kernel.
+    Otherwise rows are scored one cache-sized tile at a time (cast to float32
+    per tile, so BLAS handles every dtype) and merged into a running top-k, so
+    neither a full score vector nor an upcast copy of the matrix is materialized.
+    """
+    if numba is not None and matrix.dtype != np.float16 and k > 0:
+        scores, idx = _numba_top_k(np.asarray(matrix), np.asarray(query, dtype=np.float32), k,
+                                   numba.get_num_threads())
+        found = idx >= 0
+        scores, idx = scores[found], idx[found]
+        return idx[np.argsort(-scores, kind='stable')[:k]]
+    best_idx = np.empty(0, dtype=np.int64)
+    best_scores = np.empty(0, dtype=np.float32)
+    for start in range(0, matrix.shape[0], block):
+        tile = np.asarray(matrix[start:start + block], dtype=np.float32)
+        scores = tile @ query
+        if len(scores) > k:
+            top = np.argpartition(-scores, k - 1)[:k]
+            scores = scores[top]
+        else:
+            top = np.arange(len(scores))
+        best_idx = np.concatenate([best_idx, top + start])
+        best_scores = np.concatenate([best_scores, scores])
+        if len(best_scores) > k:
+            keep = np.argpartition(-best_scores, k - 1)[:k]
+            best_idx, best_scores = best_idx[keep], best_scores[keep]
+    return best_idx[np.argsort(-best_scores, kind='stable')]
+
+
+def _delete_chroma_source(collection: chromadb.Collection, filename: str,
+                          count: bool = False) -> Optional[int]:
+    """
+    Delete every chunk of filename from Chroma in a single delete-by-where call.
+    Listing the matching ids first (to return how many were deleted) costs an
+    extra round trip, so it is only done when count is set.
+    """
+    if not count:
+        collection.delete(where={"source": filename})
+        return None
+    existing_ids = collection.get(
+        where={"source": filename},
+        include=[]
+    )['ids']
+    if existing_ids:
+        collection.delete(ids=existing_ids)
+    return len(existing_ids)
+
+
+def _add_to_chroma(collection: chromadb.Collection, ids, embeddings, documents, metadatas) -> None:
+    """Add chunks to Chroma, passing embeddings as one float32 array (no per-float PyObjects)."""
+    collection.add(
+        documents=documents,
+        embeddings=np.asarray(embeddings, dtype=np.float32),
+        metadatas=metadatas,
+        ids=ids
+    )
+
+
+def _fetch_chunks(collection: chromadb.Collection, ids: List[str]) -> Tuple[List[str], List[dict]]:
+    """Look up documents and metadata for ids in Chroma, preserving the order of ids."""
+    if not ids:
+        return [], []
+    found = collection.get(ids=ids, include=['documents', 'metadatas'])
+    by_id = {i: (d, m) for i, d, m in zip(found['ids'], found['documents'], found['metadatas'])}
+    hits = [by_id[i] for i in ids if i in by_id]
+    return [d for d, _ in hits], [m for _, m in hits]
+
+
+class ChromaStore:
+    """Default backend: ChromaDB's HNSW index."""
+
+    def __init__(self, collection: chromadb.Collection):
+        self.collection = collection
+
+    def add(self, ids, embeddings, documents, metadatas):
+        _add_to_chroma(self.collection, ids, embeddings, documents, metadatas)
+
+    def delete_source(self, filename, count=False):
+        return _delete_chroma_source(self.collection, filename, count)
+
+    def batch(self):
+        return nullcontext()
+
+    def query(self, embedding, k):
+        results = self.collection.query(
+            query_embeddings=np.asarray(embedding, dtype=np.float32).reshape(1, -1),
+            n_results=k,
+            include=['documents', 'metadatas']
+        )
+        documents = results['documents'][0] if results['documents'] else []
+        metadatas = results['metadatas'][0] if results['metadatas'] else []
+        return documents, metadatas
+
+
+class FaissIVFPQStore:
+    """
+    FAISS IVF+PQ index for collections too large for Chroma's HNSW.
+    Chroma stays the system of record for documents and metadata; FAISS
+    only holds compressed vectors, under int64 ids handed out in order.
+    Deleting a source removes its ids from the index and from both maps, so
+    re-ingesting files doesn't grow memory in a long-running server.
+    FAISS add/remove are not safe alongside search, so one lock guards both.
+    """
+
+    def __init__(self, collection: chromadb.Collection, dim: int):
+        self.collection = collection
+        self._lock = threading.Lock()
+        self.index = faiss.index_factory(dim, FAISS_INDEX_FACTORY, faiss.METRIC_INNER_PRODUCT)
+        faiss.extract_index_ivf(self.index).nprobe = FAISS_NPROBE
+        self._next_id = 0
+        self._ids: Dict[int, str] = {}  # FAISS id -> Chroma chunk id
+        self._source_ids: Dict[str, List[int]] = {}  # filename -> its FAISS ids
+
+    @classmethod
+    def from_collection(cls, collection: chromadb.Collection) -> "FaissIVFPQStore":
+        """Train on the first FAISS_TRAIN_SAMPLE embeddings, then index the whole collection."""
+        store = None
+        offset = 0
+        while True:
+            page = collection.get(
+                include=['embeddings', 'metadatas'],
+                limit=FAISS_TRAIN_SAMPLE,
+                offset=offset
+            )
+            if not page['ids']:
+                break
+            embeddings = np.asarray(page['embeddings'], dtype=np.float32)
+            if store is None:
+                store = cls(collection, embeddings.shape[1])
+                store.index.train(embeddings)
+            store._append(page['ids'], embeddings, page['metadatas'])
+            offset += len(page['ids'])
+        if store is None:
+            raise ValueError("FAISS backend needs an ingested collection to train on")
+        return store
+
+    def _append(self, ids: Sequence[str], embeddings: np.ndarray, metadatas: Sequence[dict]):
+        start = self._next_id
+        self._next_id += len(ids)
+        self.index.add_with_ids(np.ascontiguousarray(embeddings, dtype=np.float32),
+                                np.arange(start, self._next_id, dtype=np.int64))
+        for faiss_id, chunk_id, meta in zip(range(start, self._next_id), ids, metadatas):
+            self._ids[faiss_id] = chunk_id
+            self._source_ids.setdefault(meta.get('source', '') if meta else '', []).append(faiss_id)
+
+    def add(self, ids, embeddings, documents, metadatas):
+        _add_to_chroma(self.collection, ids, embeddings, documents, metadatas)
+        with self._lock:
+            self._append(ids, embeddings, metadatas)
+
+    def delete_source(self, filename, count=False):
+        with self._lock:
+            faiss_ids = self._source_ids.pop(filename, [])
+            if faiss_ids:
+                self.index.remove_ids(np.asarray(faiss_ids, dtype=np.int64))
+                for faiss_id in faiss_ids:
+                    del self._ids[faiss_id]
+        _delete_chroma_source(self.collection, filename)
+        return len(faiss_ids)
+
+    def batch(self):
+        return nullcontext()
+
+    def query(self, embedding, k):
+        query = np.asarray(embedding, dtype=np.float32).reshape(1, -1)
+        with self._lock:
+            _, faiss_ids = self.index.search(query, k)
+            ids = [self._ids[int(i)] for i in faiss_ids[0] if i >= 0]
+        return _fetch_chunks(self.collection, ids)
+
+
+class FlatStore:
+    """
+    Exact brute-force search over vectors kept in FLAT_INDEX_PATH, stored as
+    FLAT_DTYPE. For int8, each dimension is scaled so the largest magnitude
+    stored so far maps to 127; a batch that exceeds it widens the scale and
+    requantizes the existing codes, so nothing is clipped. Queries stay fp32
+    and are divided by the same scale, so scores are dot products in the
+    original space.
+    float16 halves fp32's footprint without the clipping; float32 scans go
+    straight to BLAS sgemv. Arrays are memory-mapped on load, so startup does
+    not read the index and the OS page cache keeps hot rows resident.
+    A 1-bit sign signature per dimension (48 bytes per chunk) lets indexes of
+    at least BINARY_MIN_ROWS rows prefilter candidates by Hamming distance
+    before the exact rerank.
+    Chroma stays the system of record for documents and metadata. A lock
+    keeps queries from seeing codes, signatures and ids mid-update.
+    """
+
+    def __init__(self, collection: chromadb.Collection, path: str = FLAT_INDEX_PATH):
+        self.collection = collection
+        self._lock = threading.Lock()
+        self._deferred = 0  # open batch() contexts
+        self._dirty = False
+        self.path = path
+        self.codes: Optional[np.ndarray] = None  # (N, dim) FLAT_DTYPE
+        self.scale: Optional[np.ndarray] = None  # (dim,) float32
+        self.signatures: Optional[np.ndarray] = None  # (N, dim / 8) uint8, packed sign bits
+        self._ids: List[str] = []
+        self._sources: List[str] = []
+        if os.path.exists(os.path.join(path, 'ids.json')):
+            self._load()
+        # Rebuild when the saved index is stale: another dtype, rows and ids
+        # out of step, or chunks written to Chroma behind this store's back
+        # (ingest_pdfs.py, another process, a crash before _save)
+        if (self.codes is None or self.codes.dtype != np.dtype(FLAT_DTYPE)
+                or len(self.codes) != len(self._ids)
+                or self.collection.count() != len(self._ids)):
+            self.codes = self.scale = self.signatures = None
+            self._ids, self._sources = [], []
+            self._build_from_collection()
+        # Compile (or load from numba's cache) the scan kernel for this dtype now,
+        # so the first query doesn't pay for it; the server builds the store at startup.
+        # Numba types read-only arrays (the memory-mapped codes after a reload)
+        # separately from writable ones (codes after an add), so warm both.
+        warm = np.zeros((1, 1), dtype=FLAT_DTYPE)
+        top_k_scan(warm, np.zeros(1, dtype=np.float32), 1)
+        warm.setflags(write=False)
+        top_k_scan(warm, np.zeros(1, dtype=np.float32), 1)
+
+    def _load(self):
+        self.codes = np.load(os.path.join(self.path, 'codes.npy'), mmap_mode='r')
+        self.scale = np.load(os.path.join(self.path, 'scale.npy'))
+        signatures_path = os.path.join(self.path, 'signatures.npy')
+        if os.path.exists(signatures_path):
+            self.signatures = np.load(signatures_path, mmap_mode='r')
+        else:
+            self.signatures = np.packbits(self.codes > 0, axis=1)
+        with open(os.path.join(self.path, 'ids.json'), 'r', encoding='utf-8') as f:
+            rows = json.load(f)
+        self._ids = [chunk_id for chunk_id, _ in rows]
+        self._sources = [source for _, source in rows]
+
+    def _save(self):
+        os.makedirs(self.path, exist_ok=True)
+        for name, array in (('codes', self.codes), ('scale', self.scale),
+                            ('signatures', self.signatures)):
+            # Write aside and rename: truncating a file that is still
+            # memory-mapped would fault readers of the old mapping
+            tmp_path = os.path.join(self.path, f'{name}.tmp.npy')
+            np.save(tmp_path, array)
+            os.replace(tmp_path, os.path.join(self.path, f'{name}.npy'))
+        tmp_path = os.path.join(self.path, 'ids.tmp.json')
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(list(zip(self._ids, self._sources)), f)
+        os.replace(tmp_path, os.path.join(self.path, 'ids.json'))
+        self._dirty = False
+
+    def _changed(self):
+        """Persist after a mutation, or defer it to the end of the open batch()."""
+        self._dirty = True
+        if not self._deferred:
+            self._save()
+
+    @contextmanager
+    def batch(self):
+        with self._lock:
+            self._deferred += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._deferred -= 1
+                if not self._deferred and self._dirty:
+                    self._save()
+
+    def _build_from_collection(self, page_size: int = 10_000):
+        offset = 0
+        while True:
+            page = self.collection.get(
+                include=['embeddings', 'metadatas'],
+                limit=page_size,
+                offset=offset
+            )
+            if not page['ids']:
+                break
+            self._append(page['ids'], np.asarray(page['embeddings'], dtype=np.float32),
+                         page['metadatas'])
+            offset += len(page['ids'])
+        if self._ids:
+            self._save()
+
+    def _quantize(self, embeddings: np.ndarray) -> np.ndarray:
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        if FLAT_DTYPE != "int8":
+            if self.scale is None:
+                self.scale = np.ones(embeddings.shape[1], dtype=np.float32)
+            return embeddings.astype(FLAT_DTYPE)
+        max_abs = np.abs(embeddings).max(axis=0)
+        if self.scale is None:
+            self.scale = (127.0 / np.maximum(max_abs, 1e-6)).astype(np.float32)
+        elif np.any(max_abs * self.scale > 127.0):
+            limit = np.maximum(max_abs, 127.0 / self.scale)
+            scale = (127.0 / np.maximum(limit, 1e-6)).astype(np.float32)
+            if self.codes is not None:
+                # Rescaling to a coarser grid: re-rounding the old codes adds at
+                # most half a new step of error
+                self.codes = np.rint(self.codes * (scale / self.scale)).astype(np.int8)
+            self.scale = scale
+        return np.clip(np.rint(embeddings * self.scale), -127, 127).astype(np.int8)
+
+    def _append(self, ids: Sequence[str], embeddings: np.ndarray, metadatas: Sequence[dict]):
+        if not len(ids):
+            return
+        embeddings = np.asarray(embeddings, dtype=np.float32)
+        codes = self._quantize(embeddings)
+        signatures = np.packbits(embeddings > 0, axis=1)
+        if self.codes is None:
+            self.codes, self.signatures = codes, signatures
+        else:
+            self.codes = np.concatenate([self.codes, codes])
+            self.signatures = np.concatenate([self.signatures, signatures])
+        self._ids.extend(ids)
+        self._sources.extend(m.get('source', '') if m else '' for m in metadatas)
+
+    def add(self, ids, embeddings, documents, metadatas):
+        _add_to_chroma(self.collection, ids, embeddings, documents, metadatas)
+        with self._lock:
+            self._append(ids, embeddings, metadatas)
+            self._changed()
+
+    def delete_source(self, filename, count=False):
+        with self._lock:
+            keep = [i for i, src in enumerate(self._sources) if src != filename]
+            deleted = len(self._ids) - len(keep)
+            if deleted:
+                self.codes = self.codes[keep]
+                self.signatures = self.signatures[keep]
+                self._ids = [self._ids[i] for i in keep]
+                self._sources = [self._sources[i] for i in keep]
+                self._changed()
+        _delete_chroma_source(self.collection, filename)
+        return deleted
+
+    def query(self, embedding, k):
+        embedding = np.asarray(embedding, dtype=np.float32)
+        with self._lock:
+            if self.codes is None or not self._ids:
+                return [], []
+            query = embedding / self.scale
+            n = len(self._ids)
+            k = min(k, n)
+            n_candidates = k * BINARY_RERANK_FACTOR
+            if BINARY_RERANK_FACTOR > 0 and n >= BINARY_MIN_ROWS and n > n_candidates:
+                distances = hamming_distances(self.signatures, np.packbits(embedding > 0))
+                candidates = np.argpartition(distances, n_candidates - 1)[:n_candidates]
+                top = candidates[top_k_scan(self.codes[candidates], query, k)]
+            else:
+                top = top_k_scan(self.codes, query, k)
+            ids = [self._ids[i] for i in top]
+        return _fetch_chunks(self.collection, ids)
+
+
+def get_vector_store() -> VectorStore:
+    """
+    Get or create the search backend selected by RAG_VECTOR_BACKEND. With
+    "auto" it is chosen once at startup from the collection size: FAISS
+    IVF+PQ above FAISS_MIN_CHUNKS (if faiss is installed), Chroma otherwise.
+    """
+    global _store
+    if _store is not None:
+        return _store
+    with _store_lock:
+        if _store is None:
+            _store = _create_vector_store(get_collection())
+    return _store
+
+
+def _create_vector_store(collection: chromadb.Collection) -> VectorStore:
+    """Instantiate the backend selected by RAG_VECTOR_BACKEND."""
+    backend = VECTOR_BACKEND
+    if backend == "auto":
+        large = faiss is not None and collection.count() >= FAISS_MIN_CHUNKS
+        backend = "faiss" if large else "chroma"
+    if backend == "flat":
+        return FlatStore(collection)
+    if backend == "faiss":
+        if faiss is None:
+            raise ValueError("RAG_VECTOR_BACKEND=faiss requires the faiss package")
+        try:
+            return FaissIVFPQStore.from_collection(collection)
+        except (ValueError, RuntimeError) as e:
+            # Empty or too small to train the IVF quantizer: serve from Chroma so
+            # data can still be ingested; FAISS is used after the next restart
+            logger.warning("FAISS index not built (%s); falling back to Chroma", e)
+    return ChromaStore(collection)
+
+
+def _process_pool(max_workers: int) -> ProcessPoolExecutor:
+    """
+    Process pool for PDF extraction. Workers come from a forkserver (spawn where
+    that is unavailable) instead of a plain fork: the server forks from a worker
+    thread while torch, sqlite, Chroma and uvicorn threads are running, and a
+    forked child can deadlock on a lock one of them held. The forkserver imports
+    this module once, so only the first pool pays that startup cost (a few
+    seconds); with spawn every worker does.
+    """
+    return ProcessPoolExecutor(max_workers=max_workers, mp_context=_MP_CONTEXT)
+
+
+def _page_count(file_path: str) -> int:
+    """Number of pages in a PDF, using PDF_BACKEND."""
+    if PDF_BACKEND == "pdfium":
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(file_path)
+            try:
+                return len(pdf)
+            finally:
+                pdf.close()
+    return len(PdfReader(file_path).pages)
+
+
+def _read_pages(file_path: str, start: int = 0, stop: Optional[int] = None) -> List[str]:
+    """
+    Non-empty text of pages [start, stop) using PDF_BACKEND. Opens its own
+    document, so page ranges can be read in separate worker processes.
+    """
+    parts = []
+    if PDF_BACKEND == "pdfium":
+        with _pdfium_lock:
+            pdf = pdfium.PdfDocument(file_path)
+            try:
+                for i in range(start, len(pdf) if stop is None else min(stop, len(pdf))):
+                    page = pdf[i]
+                    textpage = page.get_textpage()
+                    page_text = textpage.get_text_range().replace('\r\n', '\n')
+                    textpage.close()
+                    page.close()
+                    if page_text:
+                        parts.append(page_text)
+            finally:
+                pdf.close()
+    else:
         reader = PdfReader(file_path)
-        text = ''
-        for page in reader.pages:
-            if page.extract_text():
-                text += page.extract_text() + '\n'
-        return text.strip()
+        for page in reader.pages[start:stop]:
+            page_text = page.extract_text()  # expensive: parses the content stream
+            if page_text:
+                parts.append(page_text)
+    return parts
+
+
+def read_pdf(file_path: str, workers: int = 1) -> str:
+    """
+    Extract text from a PDF file. With workers > 1, PDFs of at least
+    PDF_PARALLEL_MIN_PAGES pages are split into contiguous page ranges read by
+    that many processes (pypdf is pure Python, and neither backend's document
+    objects are safe to share between threads).
+    """
+    try:
+        if PDF_BACKEND == "pdfium" and pdfium is None:
+            raise ValueError("RAG_PDF_BACKEND=pdfium requires the pypdfium2 package")
+        n_pages = _page_count(file_path) if workers > 1 else 0
+        if n_pages >= PDF_PARALLEL_MIN_PAGES:
+            step = -(-n_pages // workers)
+            starts = range(0, n_pages, step)
+            with _process_pool(len(starts)) as ex:
+                futures = [ex.submit(_read_pages, file_path, start, start + step) for start in starts]
+                parts = [text for future in futures for text in future.result()]
+        else:
+            parts = _read_pages(file_path)
+        return '\n'.join(parts).strip()
     except Exception as e:
         raise ValueError(f"Error reading PDF {file_path}: {str(e)}")
 
 
+def file_digest(file_path: str) -> str:
+    """
+    Content hash of a file (blake2b, streamed in 1MB blocks) salted with the
+    chunking parameters and embedder, so changing any of those re-ingests it.
+    """
+    h = hashlib.blake2b(digest_size=16)
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            h.update(block)
+    h.update(f"\0{CHUNK_SIZE}\0{CHUNK_OVERLAP}\0{embedder_id()}".encode('utf-8'))
+    return h.hexdigest()
+
+
+def get_stored_digest(filename: str) -> Optional[str]:
+    """Content hash recorded when filename was last ingested, or None."""
+    existing = get_collection().get(
+        where={"source": filename},
+        limit=1,
+        include=['metadatas']
+    )
+    if existing['metadatas']:
+        return existing['metadatas'][0].get('file_hash')
+    return None
+
+
 def chunk_text(text: str, chunk_size: int = CHUNK_SIZE, overlap: int = CHUNK_OVERLAP) -> List[str]:
     """Chunk text into overlapping segments."""
     if not text:
         return []
-    chunks = []
-    start = 0
-    while start < len(text):
-        end = min(start + chunk_size, len(text))
-        chunks.append(text[start:end])
-        start += chunk_size - overlap
-    return chunks
+    step = chunk_size - overlap
+    return [text[start:start + chunk_size] for start in range(0, len(text), step)]
+
+
+def dedupe_chunks(chunks: Iterable[str]) -> List[str]:
+    """
+    Drop chunks whose whitespace-normalized text was already seen (repeated
+    headers, footers, boilerplate pages), keeping first occurrences in order.
+    """
+    unique = {}
+    for chunk in chunks:
+        unique.setdefault(' '.join(chunk.split()), chunk)
+    return list(unique.values())
 
 
-def ingest_pdf(file_path: str, pdf_dir: str = DEFAULT_PDF_DIR) -> Tuple[bool, str, int]:
+def extract_chunks(file_path: str, workers: int = 1) -> Tuple[str, List[str]]:
+    """
+    Read and chunk a single PDF (CPU-bound; safe to run in a worker process).
+    workers > 1 splits the pages of long PDFs across that many processes.
+    Returns: (filename, chunks)
+    """
+    text = read_pdf(file_path, workers)
+    return os.path.basename(file_path), dedupe_chunks(chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP))
+
+
+def encode_chunks(chunks: List[str]) -> np.ndarray:
+    """
+    Embed chunks as float32, reusing cached vectors for text seen before.
+    Only cache misses reach the model; encode() length-sorts them into batches.
+    """
+    model = embedder_id()
+    keys = [
+        hashlib.blake2b(f"{model}\0{c}".encode('utf-8'), digest_size=16).hexdigest()
+        for c in chunks
+    ]
+    cache = get_embed_cache()
+    cached = {}
+    unique_keys = list(dict.fromkeys(keys))
+    with _embed_cache_lock:
+        for i in range(0, len(unique_keys), 500):  # stay under sqlite's bound-variable limit
+            batch = unique_keys[i:i + 500]
+            rows = cache.execute(
+                f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                batch
+            ).fetchall()
+            cached.update((key, np.frombuffer(blob, dtype=np.float32)) for key, blob in rows)
+    
+    misses = {}  # key -> chunk, in first-seen order
+    for key, chunk in zip(keys, chunks):
+        if key not in cached:
+            misses.setdefault(key, chunk)
+    if misses:
+        encoded = get_embedder().encode(
+            list(misses.values()),
+            batch_size=EMBED_BATCH_SIZE,
+            show_progress_bar=False,
+            convert_to_numpy=True,
+            normalize_embeddings=True,
+        ).astype(np.float32, copy=False)
+        cached.update(zip(misses, encoded))
+        with _embed_cache_lock, cache:
+            cache.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)",
+                [(key, vector.tobytes()) for key, vector in zip(misses, encoded)]
+            )
+    return np.stack([cached[key] for key in keys])
+
+
+def store_chunks(filename: str, chunks: List[str], embeddings: np.ndarray, file_hash: str) -> None:
+    """Replace any stored chunks of filename with the given chunks and embeddings."""
+    store = get_vector_store()
+    n = len(chunks)
+    prefix = f"{filename}_chunk_"
+    metadatas = [None] * n
+    ids = [None] * n
+    for i in range(n):
+        metadatas[i] = {"source": filename, "chunk_id": i, "file_hash": file_hash}
+        ids[i] = prefix + str(i)
+    with store.batch():
+        store.delete_source(filename)
+        store.add(ids, embeddings, chunks, metadatas)
+    _add_source(filename)
+
+
+def ingest_pdf(file_path: str, pdf_dir: str = DEFAULT_PDF_DIR,
+               force: bool = False) -> Tuple[bool, str, int]:
     """
     Ingest a single PDF file into ChromaDB.
+    Unchanged files (same content hash) are skipped unless force is set.
     Returns: (success, message, num_chunks)
     """
+    filename = os.path.basename(file_path)
     try:
-        collection = get_collection()
-        embedder = get_embedder()
-        filename = os.path.basename(file_path)
-        
-        # Extract and chunk text
-        text = read_pdf(file_path)
-        if not text:
-            return False, f"No text extracted from {filename}", 0
+        digest = file_digest(file_path)
+        if not force and get_stored_digest(filename) == digest:
+            return True, f"{filename} is unchanged, skipped re-ingestion", 0
         
-        chunks = chunk_text(text, CHUNK_SIZE, CHUNK_OVERLAP)
+        _, chunks = extract_chunks(file_path, os.cpu_count() or 1)
         if not chunks:
-            return False, f"No chunks created from {filename}", 0
-        
-        # Remove existing chunks for this file (for re-ingestion)
-        existing_ids = collection.get(
-            where={"source": filename},
-            include=[]
-        )['ids']
-        if existing_ids:
-            collection.delete(ids=existing_ids)
-        
-        # Create embeddings and store
-        embeddings = embedder.encode(chunks)
-        metadatas = [{"source": filename, "chunk_id": i} for i in range(len(chunks))]
-        ids = [f"{filename}_chunk_{i}" for i in range(len(chunks))]
-        
-        collection.add(
-            documents=chunks,
-            embeddings=embeddings.tolist(),
-            metadatas=metadatas,
-            ids=ids
-        )
+            return False, f"No text extracted from {filename}", 0
         
+        store_chunks(filename, chunks, encode_chunks(chunks), digest)
         return True, f"Successfully ingested {filename}", len(chunks)
     except Exception as e:
         return False, f"Error ingesting {filename}: {str(e)}", 0
 
 
-def ingest_directory(pdf_dir: str = DEFAULT_PDF_DIR) -> Tuple[int, int, List[str]]:
+def ingest_directory(pdf_dir: str = DEFAULT_PDF_DIR, force: bool = False) -> Tuple[int, int, List[str]]:
     """
-    Ingest all PDFs from a directory.
+    Ingest all PDFs from a directory. Changed files (all files if force is set)
+    are read and chunked in parallel worker processes, then embedded together
+    in a single encode call.
     Returns: (success_count, failure_count, messages)
     """
     if not os.path.exists(pdf_dir):
         os.makedirs(pdf_dir, exist_ok=True)
         return 0, 0, ["Directory created. Add PDF files to ingest."]
     
+    with os.scandir(pdf_dir) as it:
+        pdf_entries = [e for e in it if e.name.lower().endswith('.pdf') and e.is_file()]
+    
+    # filename -> (success, message); filled in directory order as files resolve
+    outcomes = {}
+    pending = []  # (path, digest) of files that need (re-)ingestion
+    for entry in pdf_entries:
+        try:
+            digest = file_digest(entry.path)
+            if not force and get_stored_digest(entry.name) == digest:
+                outcomes[entry.name] = (True, f"{entry.name} is unchanged, skipped re-ingestion")
+            else:
+                pending.append((entry.path, digest))
+        except Exception as e:
+            outcomes[entry.name] = (False, f"Error ingesting {entry.name}: {str(e)}")
+    
+    # Read and chunk in parallel (pypdf is pure Python and CPU-bound)
+    extracted = []  # (filename, chunks, digest)
+    if len(pending) > 1:
+        with _process_pool(min(len(pending), os.cpu_count() or 1)) as ex:
+            futures = [(path, digest, ex.submit(extract_chunks, path)) for path, digest in pending]
+            for path, digest, future in futures:
+                filename = os.path.basename(path)
+                try:
+                    extracted.append((*future.result(), digest))
+                except Exception as e:
+                    outcomes[filename] = (False, f"Error ingesting {filename}: {str(e)}")
+    else:
+        for path, digest in pending:
+            filename = os.path.basename(path)
+            try:
+                extracted.append((*extract_chunks(path, os.cpu_count() or 1), digest))
+            except Exception as e:
+                outcomes[filename] = (False, f"Error ingesting {filename}: {str(e)}")
+    
+    for filename, chunks, _ in extracted:
+        if not chunks:
+            outcomes[filename] = (False, f"No text extracted from {filename}")
+    extracted = [item for item in extracted if item[1]]
+    
+    # One encode call over every file's chunks, then store file by file
+    if extracted:
+        all_chunks = [chunk for _, chunks, _ in extracted for chunk in chunks]
+        try:
+            embeddings = encode_chunks(all_chunks)
+        except Exception as e:
+            embeddings = None
+            for filename, _, _ in extracted:
+                outcomes[filename] = (False, f"Error ingesting {filename}: {str(e)}")
+        if embeddings is not None:
+            offset = 0
+            with get_vector_store().batch():  # flat backend: write the index once
+                for filename, chunks, digest in extracted:
+                    try:
+                        store_chunks(filename, chunks, embeddings[offset:offset + len(chunks)], digest)
+                        outcomes[filename] = (True, f"Successfully ingested {filename}")
+                    except Exception as e:
+                        outcomes[filename] = (False, f"Error ingesting {filename}: {str(e)}")
+                    offset += len(chunks)
+    
     messages = []
     success_count = 0
     failure_count = 0
-    
-    for filename in os.listdir(pdf_dir):
-        if filename.lower().endswith('.pdf'):
-            file_path = os.path.join(pdf_dir, filename)
-            success, message, num_chunks = ingest_pdf(file_path, pdf_dir)
-            messages.append(message)
-            if success:
-                success_count += 1
-            else:
-                failure_count += 1
+    for entry in pdf_entries:
+        success, message = outcomes[entry.name]
+        messages.append(message)
+        if success:
+            success_count += 1
+        else:
+            failure_count += 1
     
     return success_count, failure_count, messages
 
@@ -149,31 +1009,61 @@ def ingest_directory(pdf_dir: str = DEFAULT_PDF_DIR) -> Tuple[int, int, List[str
 def delete_pdf(filename: str) -> Tuple[bool, str]:
     """Delete all chunks for a PDF file from ChromaDB."""
     try:
-        collection = get_collection()
-        existing_ids = collection.get(
-            where={"source": filename},
-            include=[]
-        )['ids']
-        
-        if existing_ids:
-            collection.delete(ids=existing_ids)
-            return True, f"Deleted {len(existing_ids)} chunks for {filename}"
+        deleted = get_vector_store().delete_source(filename, count=True)
+        _remove_source(filename)
+        if deleted:
+            return True, f"Deleted {deleted} chunks for {filename}"
         else:
             return False, f"No chunks found for {filename}"
     except Exception as e:
         return False, f"Error deleting {filename}: {str(e)}"
 
 
+def _read_sources() -> List[str]:
+    """
+    Load the indexed-filename list; call with _sources_lock held. If the file
+    doesn't exist yet (store created before it was introduced), rebuild it
+    once from a full metadata scan.
+    """
+    if os.path.exists(SOURCES_PATH):
+        with open(SOURCES_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    results = get_collection().get(include=['metadatas'])
+    sources = sorted({m['source'] for m in results['metadatas'] if m and 'source' in m})
+    _write_sources(sources)
+    return sources
+
+
+def _write_sources(sources: List[str]) -> None:
+    os.makedirs(os.path.dirname(SOURCES_PATH) or '.', exist_ok=True)
+    tmp_path = SOURCES_PATH + '.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(sorted(sources), f)
+    os.replace(tmp_path, SOURCES_PATH)
+
+
+def update_indexed_pdfs(added: Iterable[str] = (), removed: Iterable[str] = ()) -> None:
+    """Record filenames as indexed or no longer indexed, rewriting the list atomically."""
+    with _sources_lock:
+        sources = _read_sources()
+        updated = (set(sources) | set(added)) - set(removed)
+        if updated != set(sources):
+            _write_sources(list(updated))
+
+
+def _add_source(filename: str) -> None:
+    update_indexed_pdfs(added=[filename])
+
+
+def _remove_source(filename: str) -> None:
+    update_indexed_pdfs(removed=[filename])
+
+
 def get_indexed_pdfs() -> List[str]:
     """Get list of PDF filenames currently indexed in ChromaDB."""
     try:
-        collection = get_collection()
-        results = collection.get(include=['metadatas'])
-        sources = set()
-        for metadata in results['metadatas']:
-            if 'source' in metadata:
-                sources.add(metadata['source'])
-        return sorted(list(sources))
+        with _sources_lock:
+            return _read_sources()
     except Exception:
         return []
 
@@ -185,19 +1075,45 @@ def query_rag(question: str, top_k: int = QUERY_TOP_K) -> Tuple[str, List[str],
     """
     try:
         embedder = get_embedder()
-        collection = get_collection()
+        store = get_vector_store()
         
-        query_emb = embedder.encode([question])[0]
-        results = collection.query(
-            query_embeddings=[query_emb],
-            n_results=top_k,
-            include=['documents', 'metadatas']
-        )
-        
-        context_chunks = results['documents'][0] if results['documents'] else []
-        metadatas = results['metadatas'][0] if results['metadatas'] else []
+        query_emb = embedder.encode([question], normalize_embeddings=True)[0]
+        context_chunks, metadatas = store.query(query_emb, top_k)
         
         return None, context_chunks, metadatas
     except Exception as e:
         raise ValueError(f"Error querying RAG: {str(e)}")
 
+
+# Keep-alive connection pool for Ollama, shared by the desktop and CLI clients
+OLLAMA_SESSION = requests.Session()
+OLLAMA_SESSION.mount('http://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+OLLAMA_SESSION.mount('https://', HTTPAdapter(pool_connections=4, pool_maxsize=4))
+
+
+def stream_ollama(url: str, model: str, prompt: str, token_fn: Callable[[str], None],
+                  context: Optional[List[int]] = None) -> Tuple[str, Optional[List[int]]]:
+    """
+    Stream an Ollama /api/generate completion, passing each fragment to token_fn.
+    `context` continues from earlier token IDs returned by a previous call.
+    Returns: (full text, context token IDs to continue from)
+    """
+    payload = {"model": model, "prompt": prompt, "stream": True}
+    if context:
+        payload["context"] = context
+    parts = []
+    new_context = None
+    with OLLAMA_SESSION.post(url, json=payload, stream=True, timeout=300) as resp:
+        resp.raise_for_status()
+        for line in resp.iter_lines():
+            if not line:
+                continue
+            data = json.loads(line)
+            token = data.get('response', '')
+            if token:
+                parts.append(token)
+                token_fn(token)
+            if data.get('done'):
+                new_context = data.get('context')
+                break
+    return ''.join(parts), new_context
@@ -0,0 +1,51 @@
+"""Brute-force checks for the flat backend's numba top-k kernel."""
+import numpy as np
+import pytest
+
+pytest.importorskip("numba")
+
+import rag_utils
+
+
+def brute_force_scores(matrix, query, k):
+    return np.sort(np.asarray(matrix, dtype=np.float32) @ query)[::-1][:k]
+
+
+@pytest.mark.parametrize("dtype", ["int8", "float32"])
+@pytest.mark.parametrize("n", [1, 5, 4097, 10000])
+@pytest.mark.parametrize("k", [1, 3, 7])
+def test_matches_brute_force(dtype, n, k):
+    rng = np.random.default_rng(n * 31 + k)
+    matrix = (rng.standard_normal((n, 16)) * 50).astype(dtype)
+    query = rng.standard_normal(16).astype(np.float32)
+    found = rag_utils.top_k_scan(matrix, query, k)
+    assert len(found) == min(k, n)
+    scores = np.asarray(matrix, dtype=np.float32)[found] @ query
+    np.testing.assert_allclose(scores, brute_force_scores(matrix, query, k), rtol=1e-4)
+
+
+def test_all_negative_scores():
+    # Buffers start at -inf; every real score must still displace them
+    matrix = -np.abs(np.random.default_rng(0).standard_normal((100, 8))).astype(np.float32)
+    query = np.ones(8, dtype=np.float32)
+    found = rag_utils.top_k_scan(matrix, query, 5)
+    np.testing.assert_allclose(matrix[found] @ query, brute_force_scores(matrix, query, 5), rtol=1e-5)
+
+
+def test_more_blocks_than_rows():
+    matrix = np.arange(6, dtype=np.float32).reshape(3, 2)
+    query = np.ones(2, dtype=np.float32)
+    scores, idx = rag_utils._numba_top_k(matrix, query, 2, 8)
+    best = idx[idx >= 0][np.argsort(-scores[idx >= 0], kind='stable')][:2]
+    assert list(best) == [2, 1]
+
+
+def test_read_only_memmap(tmp_path):
+    rng = np.random.default_rng(1)
+    matrix = (rng.standard_normal((5000, 32)) * 50).astype(np.int8)
+    np.save(tmp_path / "codes.npy", matrix)
+    mapped = np.load(tmp_path / "codes.npy", mmap_mode='r')
+    query = rng.standard_normal(32).astype(np.float32)
+    found = rag_utils.top_k_scan(mapped, query, 3)
+    np.testing.assert_allclose(matrix[found].astype(np.float32) @ query,
+                               brute_force_scores(matrix, query, 3), rtol=1e-4)